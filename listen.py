@@ -1,11 +1,17 @@
+import selectors
 import serial
 from serial import Serial
+import sys
 import time
 
-from main import crc16_mcrf4xx
+from tankviewer.serial_utils import crc16_mcrf4xx
 
 if __name__ == "__main__":
     with Serial("/dev/ttyUSB0", baudrate=19200, timeout=1) as ser:
+        # Sleep in the kernel until the port has data instead of spinning on in_waiting
+        sel = selectors.DefaultSelector()
+        sel.register(ser.fileno(), selectors.EVENT_READ)
         while True:
-            while ser.in_waiting > 0:
-                print(ser.read())
+            for _ in sel.select(ser.timeout):
+                sys.stdout.buffer.write(ser.read(ser.in_waiting or 1))
+                sys.stdout.buffer.flush()
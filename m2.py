@@ -1,29 +1,45 @@
+import selectors
 import serial
 from serial import Serial
 import time
 
-from main import crc16_mcrf4xx
+from tankviewer.serial_utils import crc16_mcrf4xx
+
+MESSAGES = {
+    "tare": b"T;",
+    "zero": b"Z0;",
+    "reset": b"R;",
+}
+
+# Silence, in seconds, that marks the end of a reply (about 100 character times at 19200 baud)
+REPLY_GAP = 0.05
 
 if __name__ == "__main__":
     with Serial("/dev/ttyUSB0", baudrate=19200, timeout=1) as ser:
+        sel = selectors.DefaultSelector()
+        sel.register(ser.fileno(), selectors.EVENT_READ)
         command = ""
         while command != "quit":
             command = input(">> ")
-            data = ""
-            if command == "tare":
-                data = "T"
-            elif command == "zero":
-                data = "Z0"
-            elif command == "reset":
-                data = "R"
-            elif command == "quit":
-                break
-            else:
+            data = MESSAGES.get(command)
+            if data is None:
                 continue
 
-            data += ";"
-            print(data)
-            ser.write(data.encode('ascii'))
+            print(data.decode())
+            ser.write(data)
 
-            while ser.in_waiting > 0:
-                print(ser.readline())
+            # Give the device up to the port timeout to start replying, then print the reply
+            # as it arrives until it ends its line, goes quiet for REPLY_GAP, or runs for
+            # another port timeout (a device that is streaming never goes quiet)
+            deadline = None
+            wait = ser.timeout
+            while sel.select(wait):
+                chunk = ser.read(ser.in_waiting or 1)
+                print(chunk)
+                if chunk.endswith(b"\n"):
+                    break
+                if deadline is None:
+                    deadline = time.monotonic() + ser.timeout
+                wait = min(REPLY_GAP, deadline - time.monotonic())
+                if wait <= 0:
+                    break
@@ -1,13 +1,9 @@
 #!/usr/bin/python3
 
 from argparse import ArgumentParser
-from io import BytesIO
-import matplotlib as mpl
-import matplotlib.pyplot as plot
-from matplotlib.animation import FuncAnimation
+import multiprocessing
 from os import kill, getpid
-from random import randint
-import re as regex
+import selectors
 import serial
 from serial import Serial
 import signal
@@ -17,192 +13,113 @@ from tempfile import TemporaryFile
 import time
 from threading import Thread, Event
 
-if "linux" in platform:
-    from serial.tools import list_ports_linux as list_ports
-elif "darwin" in platform:
-    from serial.tools import list_ports_osx as list_ports
-elif "win32" in platform:
-    from serial.tools import list_ports_windows as list_ports
-else:
-    from serial.tools import list_ports_posix as list_ports
-
-CRLF = bytes(bytearray([13, 10]))
-
-command = ""
-data = ""
-massData = 0
-ev_command = Event()
-ev_read_cmd = Event()
+from tankviewer._constants import BAUD, MAX_LINE, MAX_TRIES, NUM_TANKS, TIMEOUT
+from tankviewer.serial_utils import (
+    backoff_delay,
+    cache_port,
+    check_port_presence,
+    configure_port,
+    enlarge_buffers,
+    read_cached_port,
+    set_low_latency,
+)
+
+# Wire prefix, acknowledgement and data prompt (if any) for each command
+_COMMANDS = {
+    "t": (b"t", "Okay, taring...", None),
+    "c1": (b"c1", "Okay, entering phase 1 of the calibration process...", "Mass 1 (kg) >> "),
+    "c2": (b"c2", "Okay, entering phase 2 of the calibration process...", "Mass 2 (kg) >> "),
+    "c3": (b"c3", "Okay, finishing up calibration...", None),
+    "r": (b"r", "Okay, resetting the Arduino...", None),
+}
+
 ev_quit_sig = Event()
 ev_quit_ack = Event()
 
 
-def crc16_mcrf4xx(crc, data, length):
-    if not any(data) or length <= 0:
-        return crc
-
-    index = 0
-    while length > 0:
-        crc ^= ord(data[index])
-        L = crc ^ (crc << 4)
-        t = (L << 3) | (L >> 5)
-        L ^= (t & 0x07)
-        t = (t & 0xf8) ^ (((t << 1) | (t >> 7)) & 0x0f) ^ ((crc >> 8) & 0xff)
-        crc = (L << 8) | t
-        index += 1
-        length -= 1
-
-    return crc
-
-
-def configure_port(arg):
-    comports = [tuple(p) for p in list(list_ports.comports())]
-    # comports = [
-    #     c for c in comports if regex.match(r"(.*Ard.*)|(.*Ser.*)", f"{c[1]} {c[2]}")
-    # ]
-
-    if len(comports) == 0:
-        print("No available ports found, exiting...")
-        exit(1)
-
-    selection = 0
-    if arg is None:
-        print()
-        print(
-            "No port argument provided -- scanned and found the following candidate(s):"
-        )
-        for c in comports:
-            print(c)
-
-        if len(comports) > 1:
-            print("More than one Arduino device found. Please select one:")
-            for n, c in enumerate(comports):
-                print(f"{n}.", c)
-            selection = int(input("Selection:"))
-
-    else:
-        sub_comports = [c[0] for c in comports]
-        if arg not in sub_comports:
-            print(f"Port {arg} not found in list of available ports, exiting...")
-            exit(1)
-        else:
-            selection = sub_comports.index(arg)
-
-    return comports[selection][0]
-
-
-def check_port_presence(device, backoff, baud, timeout):
+def process_line(line, massData):
+    # The mass is the last space-separated field; float() accepts bytes
     try:
-        with Serial(device, baud, timeout=timeout) as s:
-            s.write(b"0xabc123")
-    except serial.PortNotOpenError:
-        time.sleep(backoff)
+        massData.value = float(line.rpartition(b" ")[2])
+    except ValueError:
         return False
     return True
 
 
-def pack_754(f, bits, exp_bits):
-    significand_bits = bits - exp_bits - 1
-
-    if f == 0.0:
-        return 0
-
-    if f < 0:
-        sign = 1
-        fnorm = -f
-    else:
-        sign = 0
-        fnorm = f
-
-    shift = 0
-    while fnorm >= 2.0:
-        fnorm /= 2.0
-        shift += 1
-    while fnorm < 1.0:
-        fnorm *= 2.0
-        shift -= 1
-    fnorm -= 1.0
-
-    significand = fnorm * ((1 << significand_bits) + 0.5)
-
-    exp = shift + ((1 << (exp_bits - 1)) -1)
-
-    return (sign << (bits - 1)) | (exp << (bits - exp_bits - 1)) | significand
+def run_serial(p, cl_args, massData, ev_data_ready, messages, ev_read_cmd):
+    buffer = bytearray()
 
+    with Serial(p, cl_args.baud, timeout=cl_args.timeout) as ser:
+        enlarge_buffers(ser)
+        set_low_latency(ser)
 
-def run_serial(p, cl_args):
-    global command
-    global data
-    global massData
+        # Sleep until the port or the command pipe is readable; Windows can't select on either
+        sel = None
+        if "win32" not in platform:
+            sel = selectors.DefaultSelector()
+            sel.register(ser, selectors.EVENT_READ)
+            sel.register(messages, selectors.EVENT_READ)
 
-    with Serial(p, cl_args.baud, timeout=cl_args.timeout) as ser:
         while True:
             try:
-                arduinoOutput = str(ser.readline().decode())
-                if arduinoOutput != "":
-                    # print(arduinoOutput)
-                    try:
-                        massData = float(arduinoOutput.split(" ")[-1])
-                    except:
-                        pass
+                if sel is None:
+                    buffer += ser.read(ser.in_waiting or 1)
+                elif any(key.fileobj is ser for key, _ in sel.select(cl_args.timeout)):
+                    buffer += ser.read(ser.in_waiting or 1)
+                end = buffer.rfind(b"\n")
+                if end != -1:
+                    # Only the newest reading is shown; older lines are parsed only if it is noise
+                    line_end = end
+                    while line_end != -1:
+                        start = buffer.rfind(b"\n", 0, line_end) + 1
+                        if process_line(bytes(buffer[start:line_end]), massData):
+                            ev_data_ready.set()
+                            break
+                        line_end = start - 1
+                    del buffer[:end + 1]
+                if len(buffer) > MAX_LINE:
+                    # Line noise or a baud mismatch; don't let the tail grow without bound
+                    buffer.clear()
 
             except serial.SerialTimeoutException:
-                print(f"Connection with device on port {port} timed out, exiting...")
+                print(f"Connection with device on port {p} timed out, exiting...")
                 exit(1)
 
-            except serial.SerialException:
-                print(f"Connection lost on port {port}, exiting...")
+            except (serial.SerialException, OSError):
+                print(f"Connection lost on port {p}, exiting...")
                 exit(1)
 
-            if ev_command.is_set(): # wait for command
-                ev_command.clear()
-                message = f"{command}:{data}\n"
-
-                print("Message:", message)
+            if not messages.poll():
+                continue
 
-                ev_read_cmd.set() # enable command input again
-                ser.write(message.encode())
+            message = messages.recv_bytes()
+            print("Message:", message.decode())
 
+            ev_read_cmd.set() # enable command input again
+            ser.write(message)
 
-def run_command(cl_args):
-    global command
-    global data
 
+def run_command(cl_args, messages, ev_read_cmd):
     while True:
-        valid = False
         command = input(">> ")
         if command == "quit":
             ev_quit_sig.set()
             ev_quit_ack.wait(1)
             ev_quit_ack.clear()
             kill(getpid(), signal.SIGKILL)
-        elif command == "t":
-            valid = True
-            print("Okay, taring...")
-            data = ""
-        elif command == "c1":
-            valid = True
-            print("Okay, entering phase 1 of the calibration process...")
-            data = input("Mass 1 (kg) >> ")
-        elif command == "c2":
-            valid = True
-            print("Okay, entering phase 2 of the calibration process...")
-            data = input("Mass 2 (kg) >> ")
-        elif command == "c3":
-            valid = True
-            print("Okay, finishing up calibration...")
-            data = ""
-        elif command == "r":
-            valid = True
-            print("Okay, resetting the Arduino...")
-            data = ""
-        else:
+
+        spec = _COMMANDS.get(command)
+        if spec is None:
             print(f'Invalid command: "{command}"')
+            continue
 
-        if valid:
-            ev_command.set()
-            ev_read_cmd.wait(cl_args.timeout * 2)
-            ev_read_cmd.clear()
+        prefix, reply, prompt = spec
+        print(reply)
+        data = input(prompt) if prompt else ""
+
+        messages.send_bytes(b"%b:%b\n" % (prefix, data.encode()))
+        ev_read_cmd.wait(cl_args.timeout * 2)
+        ev_read_cmd.clear()
 
 if __name__ == "__main__":
 
@@ -220,96 +137,139 @@ if __name__ == "__main__":
         "--max-tries",
         dest="max_tries",
         type=int,
-        nargs=1,
-        default=5,
-        help="number of times to attempt a serial connection (default: 5)",
+        default=MAX_TRIES,
+        help="number of times to attempt a serial connection (default: %(default)s)",
     )
     parser.add_argument(
         "--baud",
         dest="baud",
         type=int,
-        nargs=1,
-        default=9600,
-        help="baud rate to use for the serial connection (default: 19200)",
+        default=BAUD,
+        help="baud rate to use for the serial connection (default: %(default)s)",
     )
     parser.add_argument(
         "--timeout",
         dest="timeout",
         type=float,
-        nargs=1,
-        default=0.5,
-        help="length of time in seconds to wait on serial connection before aborting (default: 1)",
+        default=TIMEOUT,
+        help="length of time in seconds to wait on serial connection before aborting (default: %(default)s)",
     )
     parser.add_argument(
         "--num-tanks",
         dest="num_tanks",
-        nargs=1,
-        default=1,
-        help="number of presented air seeder tanks (default: 5)",
+        type=int,
+        default=NUM_TANKS,
+        help="number of presented air seeder tanks (default: %(default)s)",
     )
     args = parser.parse_args()
-    port = configure_port(args.port)
 
-    byte_stream = BytesIO()
+    # Re-runs against the same device skip the port scan entirely
+    port = read_cached_port() if args.port is None else None
+    success = port is not None and check_port_presence(port, args.baud, args.timeout)
 
-    tries = 0
-    max_tries = args.max_tries
-    success = False
-    while tries < max_tries:
-        tries += 1
-        if check_port_presence(port, tries, args.baud, args.timeout):
-            success = True
-            break
-        print(f"Unable to communicate on port {port} ({tries}/{max_tries}")
+    if not success:
+        port = configure_port(args.port)
+
+        tries = 0
+        max_tries = args.max_tries
+        while tries < max_tries:
+            tries += 1
+            if check_port_presence(port, args.baud, args.timeout):
+                success = True
+                break
+            print(f"Unable to communicate on port {port} ({tries}/{max_tries}")
+            if tries < max_tries:
+                time.sleep(backoff_delay(tries))
 
     if success:
+        assert port is not None
         print(f"Established communication with device on port {port} with baud rate {args.baud}")
+        cache_port(port)
     else:
         print(f"Max attempts reached, exiting...")
         exit(1)
 
+    massData = multiprocessing.Value("d", 0.0, lock=False)
+    message_rx, message_tx = multiprocessing.Pipe(duplex=False)
+    ev_data_ready = multiprocessing.Event()
+    ev_read_cmd = multiprocessing.Event()
+
+    # The reader runs in its own process so it never waits on the GIL while matplotlib redraws;
+    # it is started before matplotlib is imported so a forked child inherits no GUI state
+    serial_process = multiprocessing.Process(
+        target=run_serial, args=[port, args, massData, ev_data_ready, message_rx, ev_read_cmd]
+    )
+    serial_process.daemon = True
+    serial_process.start()
+
     # PLOTTING STUFF
+    # Imported only now so --help, port selection and the serial reader process never pay for it
+    import matplotlib as mpl
+    import matplotlib.pyplot as plot
+
     mpl.style.use("seaborn-colorblind")
     labels = [f"Tank {n}" for n in range(args.num_tanks)]
     bar_width = 0.5
 
     fig, ax = plot.subplots(figsize=(10,10))
 
-    def animation(_):
-        global massData
-        data = [massData for _ in range(args.num_tanks)]
-        plot.cla()
-        plot.bar(list(range(args.num_tanks)), data)
-        ax.set_ylim(bottom=0, top=30)
-        ax.set_xlabel("Tank")
-        ax.set_ylabel("Mass (kg)")
-        ax.set_title("Air Seeder Tank Masses")
-        plot.xticks([], "")
-
-    anim = FuncAnimation(plot.gcf(), animation, interval=10)
-
-
-
-    ax.set_ylim(bottom=0, top=55)
-    plot.show(block=False)
-    plot.pause(0.1)
-
-    bg = fig.canvas.copy_from_bbox(fig.bbox)
-
-    serial_thread = Thread(target=run_serial, args=[port, args])
-    serial_thread.daemon = True
-    serial_thread.start()
-
-    command_thread = Thread(target=run_command, args=[args, ])
+    # Static chrome is rendered once into a cached background; only the bars are redrawn
+    ax.set_ylim(bottom=0, top=30)
+    ax.set_xlabel("Tank")
+    ax.set_ylabel("Mass (kg)")
+    ax.set_title("Air Seeder Tank Masses")
+    ax.set_xticks([])
+    bars = ax.bar(range(args.num_tanks), [0] * args.num_tanks, animated=True)
+    bg = None
+
+    # The bars can cover the spines (the x-axis always, the top one past the y-limit), so the
+    # spines are drawn after them as in a full redraw
+    spines = list(ax.spines.values())
+    for spine in spines:
+        spine.set_animated(True)
+
+    def blit_box():
+        # The spines' antialiased edges stick out past the axes box; take them into the blitted region
+        return ax.bbox.padded(2 * max(spine.get_linewidth() for spine in spines) * fig.dpi / 72)
+
+    def blit_bars():
+        for bar in bars:
+            ax.draw_artist(bar)
+        for spine in spines:
+            ax.draw_artist(spine)
+        fig.canvas.blit(blit_box())
+
+    def on_draw(_):
+        # Full redraws (first show, resize, expose) skip the animated artists, so recache and repaint
+        global bg
+        bg = fig.canvas.copy_from_bbox(blit_box())
+        blit_bars()
+
+    fig.canvas.mpl_connect("draw_event", on_draw)
+
+    command_thread = Thread(target=run_command, args=[args, message_tx, ev_read_cmd])
     command_thread.daemon = True
     command_thread.start()
 
-    while True:
-        plot.pause(0.1)
+    def refresh():
         if ev_quit_sig.is_set():
             plot.close(fig)
+            serial_process.terminate()
             ev_quit_sig.clear()
             ev_quit_ack.set()
-        pass
-
-    pass
+            return
+
+        # Redraw only when the reader has published a new mass; a burst of readings costs one draw
+        if ev_data_ready.is_set() and bg is not None:
+            ev_data_ready.clear()
+            mass = massData.value
+            for bar in bars:
+                bar.set_height(mass)
+            fig.canvas.restore_region(bg)
+            blit_bars()
+
+    # Driven from the GUI event loop so the main thread sleeps between events
+    refresh_timer = fig.canvas.new_timer(interval=50, callbacks=[(refresh, (), {})])
+    refresh_timer.start()
+
+    plot.show()
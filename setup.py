@@ -0,0 +1,15 @@
+# Optional: compile tankviewer.serial_utils with mypyc.
+#
+#     python setup.py build_ext --inplace
+#
+# The resulting extension module is picked up ahead of serial_utils.py, which
+# stays in place as the pure-Python fallback.
+
+from mypyc.build import mypycify
+from setuptools import setup
+
+setup(
+    name="tank-viewer",
+    packages=["tankviewer"],
+    ext_modules=mypycify(["tankviewer/serial_utils.py"]),
+)
@@ -0,0 +1,17 @@
+from pathlib import Path
+
+# Command-line defaults for main.py
+BAUD = 9600
+TIMEOUT = 0.5
+MAX_TRIES = 5
+NUM_TANKS = 1
+
+# Longest partial line run_serial keeps while waiting for its newline
+MAX_LINE = 256
+
+# Device that last connected successfully, tried first when no port is given
+LAST_PORT_CACHE = Path("~/.cache/tank-viewer/last-port").expanduser()
+
+# Bounds, in seconds, of the exponential backoff between connection attempts
+INITIAL_BACKOFF = 0.5
+MAX_BACKOFF = 8.0
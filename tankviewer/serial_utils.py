@@ -0,0 +1,186 @@
+import ctypes
+from os.path import exists
+from pathlib import Path
+import random
+import serial
+from serial import Serial
+from serial.tools import list_ports
+from serial.tools.list_ports_common import ListPortInfo
+import struct
+from typing import Optional, Union
+
+from tankviewer._constants import INITIAL_BACKOFF, LAST_PORT_CACHE, MAX_BACKOFF
+
+
+def _crc16_mcrf4xx_byte(crc: int) -> int:
+    for _ in range(8):
+        if crc & 1:
+            crc = (crc >> 1) ^ 0x8408
+        else:
+            crc >>= 1
+    return crc
+
+
+# Sarwate lookup table for the reflected CCITT polynomial used by MCRF4XX
+_CRC16_TABLE = tuple(_crc16_mcrf4xx_byte(i) for i in range(256))
+
+
+# Prefer the native implementation from crc16.c when it has been built
+_libcrc16: Optional[ctypes.CDLL]
+try:
+    _libcrc16 = ctypes.CDLL(str(Path(__file__).with_name("libcrc16.so")))
+except OSError:
+    _libcrc16 = None
+else:
+    _libcrc16.crc16_mcrf4xx.restype = ctypes.c_uint16
+    _libcrc16.crc16_mcrf4xx.argtypes = [ctypes.c_uint16, ctypes.c_char_p, ctypes.c_size_t]
+
+
+def crc16_mcrf4xx(crc: int, data: Union[bytes, bytearray, memoryview], length: int) -> int:
+    if length <= 0 or not data:
+        return crc
+
+    # ctypes and the mypyc build only take bytes; coerce once so every build accepts the same input
+    data = bytes(data)
+
+    if _libcrc16 is not None:
+        return _libcrc16.crc16_mcrf4xx(crc, data, min(length, len(data)))
+
+    if length < len(data):
+        data = data[:length]
+
+    table = _CRC16_TABLE
+    for b in data:
+        crc = (crc >> 8) ^ table[(crc ^ b) & 0xff]
+
+    return crc
+
+
+def _is_candidate(port: ListPortInfo) -> bool:
+    # Arduinos and USB serial adapters mention one of these in their description/hwid
+    description = port.description or ""
+    hwid = port.hwid or ""
+    return "Ard" in description or "Ser" in description or "Ard" in hwid or "Ser" in hwid
+
+
+def configure_port(arg: Optional[str]) -> str:
+    # A device path given on the command line needs no scan
+    if arg is not None and exists(arg):
+        return arg
+
+    comports = list_ports.comports()
+    if arg is None:
+        # Offer likely devices first, but fall back to every port if none match
+        comports = [c for c in comports if _is_candidate(c)] or comports
+
+    if len(comports) == 0:
+        print("No available ports found, exiting...")
+        exit(1)
+
+    selection = 0
+    if arg is None:
+        print()
+        print(
+            "No port argument provided -- scanned and found the following candidate(s):"
+        )
+        for c in comports:
+            print(c)
+
+        if len(comports) > 1:
+            print("More than one Arduino device found. Please select one:")
+            for n, c in enumerate(comports):
+                print(f"{n}.", c)
+            selection = int(input("Selection:"))
+
+    else:
+        devices = [c.device for c in comports]
+        if arg not in devices:
+            print(f"Port {arg} not found in list of available ports, exiting...")
+            exit(1)
+        else:
+            selection = devices.index(arg)
+
+    return comports[selection].device
+
+
+def read_cached_port() -> Optional[str]:
+    try:
+        return LAST_PORT_CACHE.read_text().strip() or None
+    except OSError:
+        return None
+
+
+def cache_port(device: str) -> None:
+    # Best effort; a read-only home directory just means scanning next time
+    try:
+        LAST_PORT_CACHE.parent.mkdir(parents=True, exist_ok=True)
+        LAST_PORT_CACHE.write_text(device)
+    except OSError:
+        pass
+
+
+def check_port_presence(device: str, baud: int, timeout: float) -> bool:
+    try:
+        with Serial(device, baud, timeout=timeout) as s:
+            s.write(b"0xabc123")
+    except serial.SerialException:
+        return False
+    return True
+
+
+def backoff_delay(attempt: int) -> float:
+    # Full jitter, so several viewers retrying the same device don't stay in lockstep
+    return random.uniform(0, min(MAX_BACKOFF, INITIAL_BACKOFF * 2 ** (attempt - 1)))
+
+
+def enlarge_buffers(ser: Serial, rx_size: int = 1 << 16, tx_size: int = 4096) -> None:
+    # Only the Windows backend can resize the driver queues; POSIX ttys are left as they are
+    if hasattr(ser, "set_buffer_size"):
+        ser.set_buffer_size(rx_size=rx_size, tx_size=tx_size)
+
+
+def set_low_latency(ser: Serial) -> None:
+    # Sets ASYNC_LOW_LATENCY so USB serial adapters stop batching input on a 16 ms tick.
+    # Only pyserial's Linux backend offers this, and ttys without serial_struct refuse it.
+    if hasattr(ser, "set_low_latency_mode"):
+        try:
+            ser.set_low_latency_mode(True)
+        except ValueError:
+            pass
+
+
+# struct codes for the IEEE 754 formats the hardware already implements
+_IEEE_754_FORMATS = {(16, 5): "<e", (32, 8): "<f", (64, 11): "<d"}
+
+
+def pack_754(f: float, bits: int = 32, exp_bits: int = 8) -> int:
+    fmt = _IEEE_754_FORMATS.get((bits, exp_bits))
+    if fmt is not None:
+        return int.from_bytes(struct.pack(fmt, f), "little")
+
+    significand_bits = bits - exp_bits - 1
+
+    if f == 0.0:
+        return 0
+
+    if f < 0:
+        sign = 1
+        fnorm = -f
+    else:
+        sign = 0
+        fnorm = f
+
+    shift = 0
+    while fnorm >= 2.0:
+        fnorm /= 2.0
+        shift += 1
+    while fnorm < 1.0:
+        fnorm *= 2.0
+        shift -= 1
+    fnorm -= 1.0
+
+    significand = int(fnorm * ((1 << significand_bits) + 0.5))
+
+    exp = shift + ((1 << (exp_bits - 1)) -1)
+
+    return (sign << (bits - 1)) | (exp << (bits - exp_bits - 1)) | significand